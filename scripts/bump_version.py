@@ -19,19 +19,25 @@ import re
 import sys
 from pathlib import Path
 
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11
+    tomllib = None
 
-def get_current_version():
-    """Extract the current version from pyproject.toml."""
-    pyproject_path = Path("pyproject.toml")
-    
-    if not pyproject_path.exists():
-        print("Error: pyproject.toml not found")
-        sys.exit(1)
-        
-    with open(pyproject_path, "r") as file:
-        content = file.read()
-        
-    match = re.search(r'version\s*=\s*"([^"]+)"', content)
+VERSION_RE = re.compile(r'^version\s*=\s*"([^"]+)"', re.MULTILINE)
+VERSION_SUB_RE = re.compile(r'^(version\s*=\s*)"([^"]+)"', re.MULTILINE)
+
+
+def get_current_version(content):
+    """Extract the current version from the contents of pyproject.toml."""
+    if tomllib is not None:
+        try:
+            return tomllib.loads(content)["project"]["version"]
+        except (tomllib.TOMLDecodeError, KeyError):
+            print("Error: Could not find version in pyproject.toml")
+            sys.exit(1)
+
+    match = VERSION_RE.search(content, max(content.find("[project]"), 0))
     if not match:
         print("Error: Could not find version in pyproject.toml")
         sys.exit(1)
@@ -54,17 +60,34 @@ def bump_version(current_version, bump_type):
         sys.exit(1)
 
 
-def update_pyproject_toml(new_version):
-    """Update the version in pyproject.toml."""
+def read_and_bump(bump_type):
+    """
+    Read pyproject.toml once and compute the bumped version.
+
+    Returns a tuple of (current_version, new_version, updated_content).
+    """
     pyproject_path = Path("pyproject.toml")
     
-    with open(pyproject_path, "r") as file:
-        content = file.read()
+    if not pyproject_path.exists():
+        print("Error: pyproject.toml not found")
+        sys.exit(1)
         
-    updated_content = re.sub(r'(version\s*=\s*)"([^"]+)"', f'\\1"{new_version}"', content)
-    
-    with open(pyproject_path, "w") as file:
-        file.write(updated_content)
+    content = pyproject_path.read_text()
+    current_version = get_current_version(content)
+    new_version = bump_version(current_version, bump_type)
+    # tomllib cannot write, so substitute in place to keep the file's formatting,
+    # starting from the [project] table so other tables are left untouched
+    start = max(content.find("[project]"), 0)
+    updated_content = content[:start] + VERSION_SUB_RE.sub(
+        f'\\1"{new_version}"', content[start:], count=1
+    )
+    
+    return current_version, new_version, updated_content
+
+
+def update_pyproject_toml(updated_content, new_version):
+    """Write the updated contents of pyproject.toml."""
+    Path("pyproject.toml").write_text(updated_content)
         
     print(f"Updated pyproject.toml with version {new_version}")
 
@@ -77,38 +100,35 @@ def update_changelog(new_version):
         print("Error: CHANGELOG.md not found")
         sys.exit(1)
         
-    with open(changelog_path, "r") as file:
-        content = file.readlines()
+    content = changelog_path.read_text()
     
     today = datetime.date.today().strftime("%Y-%m-%d")
     
-    # Find where to insert the new version
-    insert_index = 0
-    for i, line in enumerate(content):
-        if line.startswith("## ["):
-            insert_index = i
-            break
+    # Insert before the first existing version heading, or at the top if none
+    if content.startswith("## ["):
+        insert_index = 0
+    else:
+        insert_index = content.find("\n## [") + 1
     
     # Create the new version block
-    new_version_block = [
-        f"## [{new_version}] - {today}\n",
-        "\n",
-        "### Added\n",
-        "- \n",
-        "\n",
-        "### Changed\n",
-        "- \n",
-        "\n",
-        "### Fixed\n",
-        "- \n",
+    new_version_block = (
+        f"## [{new_version}] - {today}\n"
         "\n"
-    ]
+        "### Added\n"
+        "- \n"
+        "\n"
+        "### Changed\n"
+        "- \n"
+        "\n"
+        "### Fixed\n"
+        "- \n"
+        "\n"
+    )
     
     # Insert the new version block
-    content = content[:insert_index] + new_version_block + content[insert_index:]
-    
-    with open(changelog_path, "w") as file:
-        file.writelines(content)
+    changelog_path.write_text(
+        content[:insert_index] + new_version_block + content[insert_index:]
+    )
         
     print(f"Updated CHANGELOG.md with version {new_version}")
     print(f"Please fill in the details for version {new_version} in CHANGELOG.md")
@@ -125,13 +145,11 @@ def main():
     # Create scripts directory if it doesn't exist
     os.makedirs("scripts", exist_ok=True)
     
-    current_version = get_current_version()
+    current_version, new_version, updated_content = read_and_bump(args.bump_type)
     print(f"Current version: {current_version}")
-    
-    new_version = bump_version(current_version, args.bump_type)
     print(f"New version: {new_version}")
     
-    update_pyproject_toml(new_version)
+    update_pyproject_toml(updated_content, new_version)
     update_changelog(new_version)
     
     print("\nNext steps:")
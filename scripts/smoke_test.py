@@ -6,6 +6,7 @@ Smoke test for mcp-openvision vision pipeline.
   1) Local repository image: sample_image.jpg
   2) Public image URL
 
+- Runs the tests concurrently, at most SMOKE_CONCURRENCY (default 10) at a time.
 - Forces the model via function param to avoid env pitfalls.
 - Writes detailed output to smoke_test_output.txt for inspection.
 """
@@ -16,13 +17,6 @@ import os
 import sys
 from datetime import datetime
 
-# Ensure local import works when run via `PYTHONPATH=src`
-try:
-    from mcp_openvision.server import image_analysis
-except Exception as e:
-    print(f"[SMOKE] Failed to import mcp_openvision.server: {e}", file=sys.stderr)
-    sys.exit(1)
-
 OUTPUT_FILE = "smoke_test_output.txt"
 
 DEFAULT_MODEL = os.environ.get(
@@ -48,9 +42,21 @@ TESTS = [
 ]
 
 
-async def run_one(test):
+def load_server():
+    """Import the server module, exiting with a clear message if that fails."""
+    # Imported lazily so that merely importing this script (e.g. during pytest
+    # collection) has no side effects. Run with `PYTHONPATH=src` for local code.
+    try:
+        from mcp_openvision import server
+    except Exception as e:
+        print(f"[SMOKE] Failed to import mcp_openvision.server: {e}", file=sys.stderr)
+        sys.exit(1)
+    return server
+
+
+async def run_one(server, test):
     try:
-        result = await image_analysis(
+        result = await server.image_analysis(
             image=test["image"],
             project_root=test["project_root"],
             query=test["query"],
@@ -65,16 +71,45 @@ async def run_one(test):
         }
 
 
+async def run_batch(server, tests, limit=10):
+    """Run tests concurrently, keeping at most `limit` requests in flight."""
+    sem = asyncio.Semaphore(limit)
+
+    async def bounded(test):
+        async with sem:
+            return await run_one(server, test)
+
+    return await asyncio.gather(*(bounded(t) for t in tests))
+
+
+def read_concurrency():
+    """Read SMOKE_CONCURRENCY, exiting with a clear message if it is invalid."""
+    value = os.environ.get("SMOKE_CONCURRENCY", "10")
+    try:
+        concurrency = int(value)
+    except ValueError:
+        concurrency = 0
+    if concurrency < 1:
+        print(
+            f"[SMOKE] SMOKE_CONCURRENCY must be a whole number of at least 1, got {value!r}.",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    return concurrency
+
+
 async def main():
     # Basic pre-check
     if not os.environ.get("OPENROUTER_API_KEY"):
         print("[SMOKE] OPENROUTER_API_KEY is not set in the environment.", file=sys.stderr)
         sys.exit(2)
 
-    results = []
-    for t in TESTS:
-        res = await run_one(t)
-        results.append(res)
+    concurrency = read_concurrency()
+
+    server = load_server()
+
+    # gather keeps results in the same order as TESTS
+    results = await run_batch(server, TESTS, concurrency)
 
     summary = {
         "ts": datetime.utcnow().isoformat() + "Z",
@@ -32,14 +32,18 @@ setup(
     python_requires=">=3.9",
     install_requires=[
         "mcp>=0.1.0",
-        "requests>=2.28.0",
+        "httpx[http2]>=0.27.0",
+        "orjson>=3.9.0",
+        "pillow",
     ],
     extras_require={
         "dev": [
             "pytest>=7.0.0",
+            "pytest-xdist>=3.0.0",
             "black>=23.0.0",
             "isort>=5.12.0",
             "mypy>=1.0.0",
+            "requests>=2.28.0",
         ],
     },
     entry_points={
@@ -1,5 +1,10 @@
 """MCP OpenVision - Vision analysis MCP server using OpenRouter."""
 
+import logging
+
+# Library logging stays silent unless the application configures handlers
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
 __version__ = "0.6.3"
 __author__ = "wojons"
 __license__ = "MIT"
@@ -2,12 +2,16 @@
 Configuration management for the OpenVision MCP server.
 """
 
+import logging
 import os
 from enum import Enum
+from functools import lru_cache
 from typing import Optional, Union
 
 from .exceptions import ConfigurationError
 
+logger = logging.getLogger(__name__)
+
 
 class VisionModel(str, Enum):
     """Available vision models from OpenRouter."""
@@ -20,10 +24,18 @@ class VisionModel(str, Enum):
     QWEN_2_5_VL = "qwen/qwen2.5-vl-32b-instruct:free"
 
 
+# Lookup table from model identifier to enum member
+_MODEL_BY_VALUE = {model.value: model for model in VisionModel}
+
+
+@lru_cache(maxsize=1)
 def get_api_key() -> str:
     """
     Get the OpenRouter API key from environment variables.
 
+    The result is cached for the lifetime of the process; call
+    `get_api_key.cache_clear()` after changing the environment.
+
     Returns:
         The API key as a string
 
@@ -39,11 +51,14 @@ def get_api_key() -> str:
     return api_key
 
 
+@lru_cache(maxsize=1)
 def get_default_model() -> Union[VisionModel, str]:
     """
     Get the default vision model from environment variables or use Qwen 2.5 VL as fallback.
 
     This function allows using any OpenRouter model, even if not in the VisionModel enum.
+    The result is cached for the lifetime of the process; call
+    `get_default_model.cache_clear()` after changing the environment.
 
     Returns:
         The default model to use (either a VisionModel enum or a custom string)
@@ -51,13 +66,56 @@ def get_default_model() -> Union[VisionModel, str]:
     default_model = os.environ.get("OPENROUTER_DEFAULT_MODEL")
     if default_model:
         # Try to match the environment variable to a VisionModel enum value
-        for model in VisionModel:
-            if model.value == default_model:
-                return model
+        model = _MODEL_BY_VALUE.get(default_model)
+        if model is not None:
+            return model
 
         # If not found in enum but a valid string, return as custom model
-        print(f"Using custom model from environment: {default_model}")
+        logger.info("Using custom model from environment: %s", default_model)
         return default_model
 
     # Return the fallback model (QWEN_2_5_VL)
     return VisionModel.QWEN_2_5_VL
+
+
+def is_response_cache_enabled() -> bool:
+    """
+    Check whether analysis results may be served from the in-memory cache.
+
+    Caching is on by default; set MCP_OPENVISION_CACHE=0 to disable it.
+
+    Returns:
+        True if the response cache should be used
+    """
+    return os.environ.get("MCP_OPENVISION_CACHE", "1") != "0"
+
+
+# Default for MCP_OPENVISION_MAX_BYTES
+DEFAULT_MAX_IMAGE_BYTES = 25 * 1024 * 1024
+
+
+def get_max_image_bytes() -> int:
+    """
+    Get the largest image size, in bytes, that will be downloaded from a URL.
+
+    Set MCP_OPENVISION_MAX_BYTES to override the 25 MiB default.
+
+    Returns:
+        The maximum image size in bytes
+
+    Raises:
+        ConfigurationError: If the variable is not a positive integer
+    """
+    value = os.environ.get("MCP_OPENVISION_MAX_BYTES")
+    if not value:
+        return DEFAULT_MAX_IMAGE_BYTES
+    try:
+        max_bytes = int(value)
+    except ValueError:
+        max_bytes = 0
+    if max_bytes <= 0:
+        raise ConfigurationError(
+            f"MCP_OPENVISION_MAX_BYTES must be a positive number of bytes, "
+            f"got {value!r}"
+        )
+    return max_bytes
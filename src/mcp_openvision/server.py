@@ -4,72 +4,380 @@ OpenVision MCP Server
 A simple MCP server that provides image analysis capabilities using OpenRouter.
 """
 
-import base64
-import json
+import hashlib
+import io
+import logging
 import sys
 import asyncio
 import os
-from pathlib import Path
 import re
 import mimetypes
-from typing import Dict, List, Optional, Any, Union, Tuple
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Annotated, AsyncIterator, Dict, List, Optional, Any, Tuple
 from urllib.parse import urlparse
 
-import requests
+import httpx
+import orjson
 from mcp.server.fastmcp import FastMCP
-from mcp import types
-
-from .config import VisionModel, get_api_key, get_default_model
+from PIL import Image, ImageOps
+from pydantic import Field
+
+from .cache import LRUCache
+from .config import (
+    VisionModel,
+    get_api_key,
+    get_default_model,
+    get_max_image_bytes,
+    is_response_cache_enabled,
+)
 from .exceptions import OpenRouterError, ConfigurationError
 
+try:
+    import pybase64 as _b64
+
+    # Produces the str directly, skipping the intermediate bytes copy
+    _b64encode_as_string = _b64.b64encode_as_string
+except ImportError:  # pybase64 is optional; its SIMD codec is faster on large images
+    import base64 as _b64
+
+    def _b64encode_as_string(data: bytes) -> str:
+        return _b64.b64encode(data).decode("ascii")
+
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # OpenCV is optional; Pillow handles re-encoding without it
+    cv2 = None
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# System prompt used when the caller does not provide one
+DEFAULT_SYSTEM_PROMPT = (
+    "You are an expert vision analyzer with exceptional attention to detail. Your "
+    "purpose is to provide accurate, comprehensive descriptions of images that "
+    "help AI agents understand visual content they cannot directly perceive. "
+    "Focus on describing all relevant elements in the image - objects, people, "
+    "text, colors, spatial relationships, actions, and context. Be precise but "
+    "concise, organizing information from most to least important. Avoid making "
+    "assumptions beyond what's visible and clearly indicate any uncertainty. When "
+    "text appears in images, transcribe it verbatim within quotes. Respond only "
+    "with factual descriptions without subjective judgments or creative "
+    "embellishments. Your descriptions should enable an agent to make informed "
+    "decisions based solely on your analysis."
+)
+
+# Largest number of images accepted by image_analysis_batch
+MAX_BATCH_SIZE = 16
+
+# Headers sent with every OpenRouter request; only Authorization varies
+OPENROUTER_HEADERS = {
+    "Content-Type": "application/json",
+    "HTTP-Referer": "https://github.com/modelcontextprotocol/mcp-openvision",
+    "X-Title": "MCP OpenVision",
+}
+
+# Shared HTTP client for OpenRouter calls and image downloads, created lazily on
+# first use so that pooled connections are reused across tool invocations
+_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it if needed."""
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        # HTTP/2 lets concurrent requests share a single TLS connection
+        _CLIENT = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=128, max_keepalive_connections=32),
+            timeout=httpx.Timeout(60, connect=5),
+        )
+    return _CLIENT
+
+
+async def _close_client() -> None:
+    """Close the shared HTTP client if it was created."""
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
+
+@asynccontextmanager
+async def _lifespan(server: FastMCP) -> AsyncIterator[None]:
+    """Release pooled connections when the server shuts down."""
+    try:
+        yield
+    finally:
+        await _close_client()
+
+
 # Initialize FastMCP with dependencies
 mcp = FastMCP(
     "OpenVision",
     instructions="Vision analysis tool for images using OpenRouter",
+    dependencies=["httpx[http2]", "orjson"],
+    lifespan=_lifespan,
 )
 
 # Ensure mimetypes are initialized
 mimetypes.init()
 
 
+# Base64 encodings keyed by a digest of the raw bytes, so repeated analyses of
+# the same image skip re-encoding
+_BASE64_CACHE: LRUCache[str] = LRUCache(maxsize=32)
+
+
 def encode_image_to_base64(image_data: bytes) -> str:
-    """Encode image data to base64."""
-    return base64.b64encode(image_data).decode("utf-8")
+    """Encode image data to base64, reusing cached results for repeated images."""
+    key = hashlib.blake2b(image_data, digest_size=16).digest()
+    encoded = _BASE64_CACHE.get(key)
+    if encoded is None:
+        encoded = _b64encode_as_string(image_data)
+        _BASE64_CACHE.set(key, encoded)
+    return encoded
+
+
+# Read size used when streaming image downloads
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Downloaded images keyed by URL, kept for a few minutes so repeated questions
+# about the same remote image skip the download
+_URL_CACHE: LRUCache[Tuple[str, str]] = LRUCache(maxsize=64, ttl=300)
+
+
+# Encoded local files keyed by (path, mtime, size), so re-analyzing an
+# unchanged file skips reading and encoding it again
+_PATH_CACHE: LRUCache[Tuple[str, str]] = LRUCache(maxsize=32)
+
+# Analysis results keyed by a digest of the image and request parameters, so
+# agents re-asking the same question about the same image get an instant answer
+_RESPONSE_CACHE: LRUCache[str] = LRUCache(maxsize=512, ttl=3600)
+
+# Results for image URLs forwarded to OpenRouter are keyed by the URL, not the
+# image bytes, so they expire as quickly as downloaded images in case the
+# image behind the URL changes
+_URL_RESPONSE_CACHE: LRUCache[str] = LRUCache(maxsize=512, ttl=300)
+
+# Above this temperature model output varies between calls, so responses are
+# neither cached nor shared between concurrent identical requests
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.5
+
+# Pending OpenRouter requests, keyed like the response cache
+_IN_FLIGHT: Dict[bytes, "asyncio.Future[str]"] = {}
+
+
+class _RequestAbandoned(Exception):
+    """Set on an in-flight request whose caller was cancelled before it finished."""
+
+
+def _response_cache_key(image_url: str, **params: Any) -> bytes:
+    """
+    Derive a compact cache key for an OpenRouter request.
+
+    Args:
+        image_url: The image URL or data URL sent to the model
+        **params: The remaining request parameters (model, prompts, sampling options)
+
+    Returns:
+        A 16-byte digest identifying the request
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(orjson.dumps(params, option=orjson.OPT_SORT_KEYS))
+    hasher.update(image_url.encode("utf-8"))
+    return hasher.digest()
+
+
+# Image formats keyed by their leading signature bytes
+_MAGIC_BYTES = {
+    b"\x89PN": "image/png",
+    b"\xff\xd8\xff": "image/jpeg",
+    b"GIF": "image/gif",
+}
+
+
+def _sniff_mime_type(image_data: bytes) -> Optional[str]:
+    """
+    Identify common image formats from their leading signature bytes.
+
+    Args:
+        image_data: Raw image data, or at least its first 12 bytes
+
+    Returns:
+        The MIME type, or None if the format is not recognised
+    """
+    mime_type = _MAGIC_BYTES.get(bytes(image_data[:3]))
+    if mime_type:
+        return mime_type
+    # WebP is a RIFF container, so the format tag sits at an offset;
+    # startswith with a start index compares in place without slicing
+    if image_data.startswith(b"RIFF") and image_data.startswith(b"WEBP", 8):
+        return "image/webp"
+    return None
+
+
+# Extension lookups repeat across calls for the same paths and URLs
+_guess_type = lru_cache(maxsize=512)(mimetypes.guess_type)
 
 
 def get_mime_type(file_path: str, image_data: Optional[bytes] = None) -> str:
     """
-    Determine MIME type from file extension or image data.
+    Determine MIME type from image data or file extension.
+
+    The image data is checked first, since a misleading extension would
+    otherwise send the model a data URL whose type does not match its content.
 
     Args:
         file_path: Path or URL to the image
-        image_data: Optional raw image data to check if path doesn't provide mime type
+        image_data: Optional raw image data to check before the extension
 
     Returns:
         MIME type as a string (defaults to image/jpeg if cannot be determined)
     """
-    # First try to get mime type from file extension
-    mime_type, _ = mimetypes.guess_type(file_path)
+    if image_data:
+        mime_type = _sniff_mime_type(image_data)
+        if mime_type:
+            return mime_type
+
+    # Fall back to the file extension
+    mime_type, _ = _guess_type(file_path)
 
     if mime_type and mime_type.startswith("image/"):
         return mime_type
 
-    # Fallback to examining file headers if we have image data
-    if image_data:
-        # Check for PNG signature
-        if image_data.startswith(b"\x89PNG\r\n\x1a\n"):
-            return "image/png"
-        # Check for JPEG signature
-        elif image_data.startswith(b"\xff\xd8\xff"):
-            return "image/jpeg"
-        # Check for WebP signature
-        elif image_data.startswith(b"RIFF") and b"WEBP" in image_data[0:12]:
-            return "image/webp"
-
     # Default to JPEG if we couldn't determine the type
     return "image/jpeg"
 
 
+# PNGs larger than this are re-encoded as JPEG before upload, since large
+# screenshots otherwise dominate request size
+PNG_REENCODE_MIN_BYTES = 200_000
+JPEG_QUALITY = 85
+# Images are downscaled so their longest side fits within this many pixels,
+# which bounds upload size and vision token cost for high-resolution input
+MAX_IMAGE_DIMENSION = 1568
+
+
+# EXIF tag recording how a photo must be rotated for display
+_EXIF_ORIENTATION = 0x0112
+
+
+def _reencode_as_jpeg(
+    image_data: bytes, max_dimension: int, orientation: int = 1
+) -> bytes:
+    """
+    Re-encode an image as JPEG, using OpenCV when available.
+
+    The output carries no EXIF data, so any orientation is applied to the
+    pixels first.
+
+    Args:
+        image_data: Raw image bytes
+        max_dimension: Downscale the image so neither side exceeds this size
+        orientation: The image's EXIF orientation, 1 if it needs no rotation
+
+    Returns:
+        The JPEG-encoded image bytes
+    """
+    # IMREAD_UNCHANGED ignores EXIF, so rotated photos go through Pillow
+    if cv2 is not None and orientation == 1:
+        arr = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_UNCHANGED)
+        # OpenCV covers the common opaque 8-bit case; images with an alpha
+        # channel or a higher bit depth go through Pillow below
+        if (
+            arr is not None
+            and arr.dtype == np.uint8
+            and (arr.ndim == 2 or arr.shape[2] == 3)
+        ):
+            height, width = arr.shape[:2]
+            if max(height, width) > max_dimension:
+                scale = max_dimension / max(height, width)
+                arr = cv2.resize(
+                    arr,
+                    (max(1, round(width * scale)), max(1, round(height * scale))),
+                    interpolation=cv2.INTER_AREA,
+                )
+            ok, buf = cv2.imencode(
+                ".jpg",
+                arr,
+                [
+                    int(cv2.IMWRITE_JPEG_QUALITY),
+                    JPEG_QUALITY,
+                    int(cv2.IMWRITE_JPEG_OPTIMIZE),
+                    1,
+                    int(cv2.IMWRITE_JPEG_PROGRESSIVE),
+                    1,
+                ],
+            )
+            if ok:
+                return buf.tobytes()
+
+    with Image.open(io.BytesIO(image_data)) as raw, ImageOps.exif_transpose(raw) as src:
+        if src.mode in ("RGBA", "LA", "PA") or "transparency" in src.info:
+            # JPEG has no alpha channel, so flatten onto a white background
+            with src.convert("RGBA") as rgba:
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            img = src.convert("RGB")
+
+    with img, io.BytesIO() as buf:
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        img.save(
+            buf, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True
+        )
+        return buf.getvalue()
+
+
+def _normalize_for_upload(image_data: bytes, mime_type: str) -> Tuple[bytes, str]:
+    """
+    Shrink images before upload by downscaling and re-encoding them as JPEG.
+
+    Images larger than MAX_IMAGE_DIMENSION are always downscaled. Large PNGs
+    within that size are re-encoded only if that makes them smaller.
+
+    Args:
+        image_data: Raw image bytes
+        mime_type: The MIME type detected for the image
+
+    Returns:
+        Tuple containing (image_bytes, mime_type), unchanged if no
+        normalization applies
+    """
+    try:
+        # Opening only parses the header, so this is cheap for any size
+        with Image.open(io.BytesIO(image_data)) as img:
+            width, height = img.size
+            orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+    except Exception:
+        # Leave images that cannot be decoded untouched
+        return image_data, mime_type
+
+    oversized = max(width, height) > MAX_IMAGE_DIMENSION
+    large_png = len(image_data) > PNG_REENCODE_MIN_BYTES and image_data.startswith(
+        b"\x89PNG\r\n\x1a\n"
+    )
+    if not oversized and not large_png:
+        return image_data, mime_type
+
+    try:
+        jpeg_data = _reencode_as_jpeg(image_data, MAX_IMAGE_DIMENSION, orientation)
+    except Exception:
+        return image_data, mime_type
+
+    if not oversized and len(jpeg_data) >= len(image_data):
+        return image_data, mime_type
+    return jpeg_data, "image/jpeg"
+
+
+# URL schemes recognised by is_url
+_URL_SCHEMES = ("http://", "https://", "ftp://", "file://")
+
+
 def is_url(string: str) -> bool:
     """
     Check if the provided string is a URL.
@@ -80,6 +388,11 @@ def is_url(string: str) -> bool:
     Returns:
         True if the string is a URL, False otherwise
     """
+    # Reject anything without a supported scheme before parsing, so large
+    # base64 payloads never reach urlparse
+    if not string[:8].lower().startswith(_URL_SCHEMES):
+        return False
+
     try:
         result = urlparse(string)
         return all([result.scheme, result.netloc])
@@ -87,6 +400,10 @@ def is_url(string: str) -> bool:
         return False
 
 
+# Number of leading characters decoded when checking whether input is base64
+BASE64_PROBE_CHARS = 4096
+
+
 def is_base64(string: str) -> bool:
     """
     Check if the provided string is base64-encoded.
@@ -97,38 +414,34 @@ def is_base64(string: str) -> bool:
     Returns:
         True if the string appears to be base64-encoded, False otherwise
     """
+    if not isinstance(string, str):
+        return False
+
     # Remove base64 URL prefix if present
     if string.startswith("data:image"):
-        # Extract the actual base64 content
-        pattern = r"base64,(.*)"
-        match = re.search(pattern, string)
-        if match:
-            string = match.group(1)
+        _, _, string = string.partition("base64,")
+
+    # Encoded data always comes in 4-character groups; anything shorter is
+    # probably not base64
+    if len(string) < 4 or len(string) % 4:
+        return False
 
-    # Check if string is base64
+    # Strictly decode only the head and the padded tail, so checking a
+    # multi-megabyte image costs the same as checking a short string
     try:
-        # Check if the string matches base64 pattern
-        if not isinstance(string, str):
-            return False
-
-        # Check if the string follows base64 format (may have padding)
-        # This regex allows for the standard base64 character set and optional padding
-        if not re.match(r"^[A-Za-z0-9+/]*={0,2}$", string):
-            return False
-
-        # If it's too short, it's probably not base64
-        if len(string) < 4:  # Minimum meaningful base64 is 4 chars
-            return False
-
-        # Try decoding - this will raise an exception if not valid base64
-        decoded = base64.b64decode(string)
-        # If we can decode it, it's likely base64
+        _b64.b64decode(string[:BASE64_PROBE_CHARS], validate=True)
+        if len(string) > BASE64_PROBE_CHARS:
+            _b64.b64decode(string[-4:], validate=True)
         return True
     except Exception:
         # If any exception occurs during decoding, it's not valid base64
         return False
 
 
+# MIME type of a base64 data URL
+_DATA_URL_MIME_RE = re.compile(r"data:(image/[^;]+)")
+
+
 def extract_mime_type_from_data_url(data_url: str) -> str:
     """
     Extract MIME type from a data URL.
@@ -139,17 +452,34 @@ def extract_mime_type_from_data_url(data_url: str) -> str:
     Returns:
         The MIME type or 'image/jpeg' if not found
     """
-    pattern = r"data:(image/[^;]+)"
-    match = re.search(pattern, data_url)
+    match = _DATA_URL_MIME_RE.search(data_url)
     if match:
         return match.group(1)
     return "image/jpeg"
 
 
-def load_image_from_url(url: str) -> str:
+def _encode_for_upload(image_data: bytes, mime_type: str) -> Tuple[str, str]:
+    """
+    Normalize raw image bytes for upload and encode them as base64.
+
+    Args:
+        image_data: Raw image bytes
+        mime_type: The MIME type detected for the image
+
+    Returns:
+        Tuple containing (base64_encoded_image, mime_type)
+    """
+    image_data, mime_type = _normalize_for_upload(image_data, mime_type)
+    return encode_image_to_base64(image_data), mime_type
+
+
+async def load_image_from_url(url: str) -> Tuple[str, str]:
     """
     Download an image from a URL and convert it to base64.
 
+    Results are cached by URL for a few minutes unless the server marks the
+    response as uncacheable.
+
     Args:
         url: The URL of the image
 
@@ -157,29 +487,103 @@ def load_image_from_url(url: str) -> str:
         Tuple containing (base64_encoded_image, mime_type)
 
     Raises:
-        Exception: If the image cannot be downloaded
+        Exception: If the image cannot be downloaded, is served as text, or
+            exceeds the MCP_OPENVISION_MAX_BYTES limit
+        ConfigurationError: If MCP_OPENVISION_MAX_BYTES is invalid
     """
+    cached = _URL_CACHE.get(url)
+    if cached is not None:
+        return cached
+
+    # Anything bigger is rejected before (or while) it is downloaded
+    max_bytes = get_max_image_bytes()
+
     try:
-        response = requests.get(url, stream=True, timeout=10)
-        response.raise_for_status()  # Raise exception for 4XX/5XX responses
+        async with _get_client().stream(
+            "GET", url, follow_redirects=True, timeout=httpx.Timeout(30, connect=5)
+        ) as response:
+            response.raise_for_status()  # Raise exception for 4XX/5XX responses
+
+            # Explicitly handle non-200 responses (helps when raise_for_status is mocked)
+            if response.status_code != 200:
+                raise Exception(
+                    f"Failed to download image from URL: {url}, "
+                    f"error: HTTP {response.status_code}"
+                )
+
+            # Bail out on the headers alone when they already show the body
+            # is not an image or is too large, before reading any of it
+            content_type = response.headers.get("Content-Type")
+            if content_type and content_type.startswith("text/"):
+                raise Exception(
+                    f"URL does not point to an image: {url} "
+                    f"(Content-Type: {content_type})"
+                )
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit():
+                if int(content_length) > max_bytes:
+                    raise Exception(
+                        f"Image at {url} is too large: {content_length} bytes "
+                        f"(limit {max_bytes})"
+                    )
+
+            # Accumulate the body in one growing buffer rather than letting
+            # httpx join a list of chunks, which briefly holds two copies.
+            # The size limit is enforced here too, since Content-Length may
+            # be missing or wrong.
+            image_data = bytearray()
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                image_data += chunk
+                if len(image_data) > max_bytes:
+                    raise Exception(
+                        f"Image at {url} is too large: more than " f"{max_bytes} bytes"
+                    )
+    except httpx.HTTPError as e:
+        raise Exception(f"Failed to download image from URL: {url}, error: {str(e)}")
 
-        # Explicitly handle non-200 responses (helps when raise_for_status is mocked)
-        if response.status_code != 200:
-            raise Exception(f"Failed to download image from URL: {url}, error: HTTP {response.status_code}")
+    # Fall back to sniffing when the server sent no usable image type
+    if not content_type or not content_type.startswith("image/"):
+        content_type = get_mime_type(url, image_data)
 
-        # Get content type from headers or guess from URL
-        content_type = response.headers.get("Content-Type")
-        if not content_type or not content_type.startswith("image/"):
-            content_type = get_mime_type(url, response.content)
+    result = await asyncio.to_thread(_encode_for_upload, image_data, content_type)
+    cache_control = response.headers.get("Cache-Control", "")
+    if "no-store" not in cache_control and "no-cache" not in cache_control:
+        _URL_CACHE.set(url, result)
+    return result
 
-        return encode_image_to_base64(response.content)
-    except requests.RequestException as e:
-        raise Exception(f"Failed to download image from URL: {url}, error: {str(e)}")
+
+def _read_image_file(file_path: str) -> Tuple[str, str]:
+    """
+    Read and encode an image file, reusing the result while it is unchanged.
+
+    Args:
+        file_path: Path to an existing image file
+
+    Returns:
+        Tuple containing (base64_encoded_image, mime_type)
+    """
+    # Read the whole file with one unbuffered read sized from fstat, which also
+    # provides the cache key without a separate stat call
+    fd = os.open(file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        stat = os.fstat(fd)
+        key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+        cached = _PATH_CACHE.get(key)
+        if cached is not None:
+            return cached
+        image_data = os.read(fd, stat.st_size)
+    finally:
+        os.close(fd)
+
+    mime_type = get_mime_type(file_path, image_data)
+    result = _encode_for_upload(image_data, mime_type)
+    _PATH_CACHE.set(key, result)
+    return result
 
 
 def load_image_from_path(
     path: str, project_root: Optional[str] = None
-) -> str:
+) -> Tuple[str, str]:
     """
     Load an image from a local file path and convert it to base64.
 
@@ -194,18 +598,14 @@ def load_image_from_path(
         FileNotFoundError: If the image file does not exist
         PermissionError: If the image file cannot be read
     """
-    # Create a Path object from the input path
-    file_path = Path(path)
-
+    # Files are opened directly and a missing file is handled as an error,
+    # rather than checking for existence first and paying for a second stat.
     # If the path is absolute, use it directly
-    if file_path.is_absolute():
-        if not file_path.exists():
-            raise FileNotFoundError(f"Image file not found at absolute path: {path}")
+    if os.path.isabs(path):
         try:
-            with open(file_path, "rb") as f:
-                image_data = f.read()
-                mime_type = get_mime_type(str(file_path), image_data)
-                return encode_image_to_base64(image_data)
+            return _read_image_file(path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise FileNotFoundError(f"Image file not found at absolute path: {path}")
         except PermissionError:
             raise PermissionError(
                 f"Permission denied when trying to read image file at: {path}"
@@ -213,29 +613,23 @@ def load_image_from_path(
         except Exception as e:
             raise Exception(f"Error reading image file at: {path}, error: {str(e)}")
 
-    # For relative paths, we need to handle differently
-    paths_to_try = [file_path]  # Always try the direct path first
-
-    # If project_root is provided, try resolving against it
+    # Relative paths are tried as given first, then under project_root. The
+    # candidates are normalized and de-duplicated so a project_root of "." does
+    # not try the same file twice
+    paths_to_try = [os.path.normpath(path)]
     if project_root:
-        # Normalize path regardless of OS
-        root_path = Path(project_root)
-        if root_path.exists() and root_path.is_dir():
-            paths_to_try.append(root_path / path)
+        paths_to_try.append(os.path.normpath(os.path.join(project_root, path)))
+    paths_to_try = list(dict.fromkeys(paths_to_try))
 
     # Try each path
     for p in paths_to_try:
-        if p.exists():
-            try:
-                with open(p, "rb") as f:
-                    image_data = f.read()
-                    mime_type = get_mime_type(str(p), image_data)
-                    return encode_image_to_base64(image_data)
-            except PermissionError:
-                # Continue to try other paths if permission error
-                continue
-            except Exception as e:
-                raise Exception(f"Error reading image file at: {p}, error: {str(e)}")
+        try:
+            return _read_image_file(p)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            # Continue to try other paths if missing or unreadable
+            continue
+        except Exception as e:
+            raise Exception(f"Error reading image file at: {p}, error: {str(e)}")
 
     # If we get here, the file wasn't found
     if project_root:
@@ -248,42 +642,55 @@ def load_image_from_path(
         )
 
 
-def process_image_input(
-    image: str, project_root: Optional[str] = None
-) -> str:
+def _classify_image_input(image: str) -> str:
     """
-    Process the image input, which can be a URL, file path, or base64-encoded data.
+    Decide which kind of image input a string is.
 
     Args:
-        image: The image input as a URL, file path, or base64-encoded data
-        project_root: Optional root directory to resolve relative paths against
+        image: The image input as a data URL, URL, file path, or base64-encoded data
 
     Returns:
-        Tuple containing (base64_encoded_image, mime_type)
-
-    Raises:
-        ValueError: If the image cannot be processed
+        One of "data_url", "url", "base64" or "path"
     """
-    # Check if the image is already a data URL with base64
-    if image.startswith("data:image"):
-        mime_type = extract_mime_type_from_data_url(image)
-        pattern = r"base64,(.*)"
-        match = re.search(pattern, image)
-        if match:
-            return match.group(1)
+    # Data URLs carry their MIME type in a short header before the payload
+    if image.startswith("data:image") and ";base64," in image[:128]:
+        return "data_url"
+
+    # The prefix test keeps URL detection cheap for the common case before
+    # falling back to a full parse
+    if image.startswith(("http://", "https://")) or is_url(image):
+        return "url"
 
-    # Check if the image is just base64-encoded (without data URL prefix)
     if is_base64(image):
-        # For plain base64, we'll need to guess the mime type
-        return image  # Default to jpeg for plain base64 when determining mime later
+        return "base64"
+
+    return "path"
+
+
+async def _from_data_url(image: str, project_root: Optional[str]) -> Tuple[str, str]:
+    """Split a base64 data URL into its payload and MIME type."""
+    header, _, payload = image.partition(",")
+    return payload, extract_mime_type_from_data_url(header)
+
 
-    # Check if the image is a URL
-    if is_url(image):
-        return load_image_from_url(image)
+async def _from_url(image: str, project_root: Optional[str]) -> Tuple[str, str]:
+    """Download and encode a remote image."""
+    return await load_image_from_url(image)
 
-    # Check if the image is a file path
+
+async def _from_base64(image: str, project_root: Optional[str]) -> Tuple[str, str]:
+    """Label plain base64 data with the image type sniffed from its first bytes."""
+    # Plain base64 carries no type information, so sniff it from the first
+    # decoded bytes and default to jpeg
+    head = _b64.b64decode(image[:16])
+    return image, _sniff_mime_type(head) or "image/jpeg"
+
+
+async def _from_path(image: str, project_root: Optional[str]) -> Tuple[str, str]:
+    """Read and encode a local image file."""
+    # Reading and encoding a file is blocking work, so it runs off the event loop
     try:
-        return load_image_from_path(image, project_root)
+        return await asyncio.to_thread(load_image_from_path, image, project_root)
     except (FileNotFoundError, PermissionError) as e:
         raise ValueError(
             f"Invalid image input: {str(e)}. "
@@ -293,18 +700,229 @@ def process_image_input(
         raise ValueError(f"Error processing image: {str(e)}")
 
 
+# Image loaders keyed by the kind returned from _classify_image_input
+_LOADERS = {
+    "data_url": _from_data_url,
+    "url": _from_url,
+    "base64": _from_base64,
+    "path": _from_path,
+}
+
+
+async def process_image_input(
+    image: str, project_root: Optional[str] = None, kind: Optional[str] = None
+) -> Tuple[str, str]:
+    """
+    Process the image input, which can be a URL, file path, or base64-encoded data.
+
+    Args:
+        image: The image input as a URL, file path, or base64-encoded data
+        project_root: Optional root directory to resolve relative paths against
+        kind: The input kind from _classify_image_input, if already known
+
+    Returns:
+        Tuple containing (base64_encoded_image, mime_type)
+
+    Raises:
+        ValueError: If the image cannot be processed
+    """
+    if kind is None:
+        kind = _classify_image_input(image)
+    return await _LOADERS[kind](image, project_root)
+
+
+async def _image_url(
+    image: str, project_root: Optional[str] = None, force_inline: bool = False
+) -> str:
+    """
+    Resolve an image input to the URL sent to OpenRouter.
+
+    Remote http(s) images are passed through for OpenRouter to fetch itself
+    and base64 data URLs are passed through as they are; everything else is
+    loaded and inlined as a base64 data URL.
+
+    Args:
+        image: The image input as a URL, file path, or base64-encoded data
+        project_root: Optional root directory to resolve relative paths against
+        force_inline: Download remote images and inline them instead of
+            passing their URL through
+
+    Returns:
+        The image URL or data URL
+
+    Raises:
+        ValueError: If the image cannot be processed
+    """
+    # Classify once and hand the result to process_image_input, which would
+    # otherwise run the same checks again
+    kind = _classify_image_input(image)
+
+    if kind == "url" and not force_inline and image.startswith(("http://", "https://")):
+        return image
+
+    # Splitting a data URL apart only to join it back together would copy the
+    # whole payload twice
+    if kind == "data_url":
+        return image
+
+    base64_image, mime_type = await process_image_input(image, project_root, kind)
+    return f"data:{mime_type};base64,{base64_image}"
+
+
+@lru_cache(maxsize=1)
+def _request_headers(api_key: str) -> Dict[str, str]:
+    """
+    Build the OpenRouter request headers, reusing them while the key is unchanged.
+
+    Args:
+        api_key: The OpenRouter API key
+
+    Returns:
+        The static OpenRouter headers plus Authorization
+    """
+    return {**OPENROUTER_HEADERS, "Authorization": f"Bearer {api_key}"}
+
+
+def _build_payload(
+    image_urls: List[str],
+    query: str,
+    system_prompt: str,
+    model: str,
+    max_tokens: int,
+    temperature: float,
+    **options: Optional[float],
+) -> Dict[str, Any]:
+    """
+    Build an OpenRouter chat completion request for one or more images.
+
+    Args:
+        image_urls: Data URLs of the images, sent in order after the query
+        query: Text prompt to guide the image analysis
+        system_prompt: Instructions for the model defining its role and behavior
+        model: The model identifier to send to OpenRouter
+        max_tokens: Maximum number of tokens in the response
+        temperature: Temperature parameter for generation
+        **options: Optional sampling parameters; those set to None are omitted
+
+    Returns:
+        The JSON request body
+    """
+    # Prepare messages for the OpenRouter request
+    content: List[Dict[str, Any]] = [{"type": "text", "text": query}]
+    content.extend(
+        {"type": "image_url", "image_url": {"url": url}} for url in image_urls
+    )
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content},
+    ]
+
+    # Start with required parameters
+    payload = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+
+    # Add optional parameters if provided
+    payload.update({k: v for k, v in options.items() if v is not None})
+
+    return payload
+
+
+async def _request_analysis(headers: Dict[str, str], payload: Dict[str, Any]) -> str:
+    """
+    Send a chat completion request to OpenRouter and return the analysis text.
+
+    Args:
+        headers: HTTP headers for the request
+        payload: The JSON request body
+
+    Returns:
+        The content of the model's reply
+
+    Raises:
+        OpenRouterError: If the request fails, the response cannot be parsed,
+            or the stream ends before the reply is complete
+    """
+    try:
+        # Stream the completion so the body is consumed as tokens arrive
+        async with _get_client().stream(
+            "POST",
+            OPENROUTER_API_URL,
+            headers=headers,
+            content=orjson.dumps({**payload, "stream": True}),
+        ) as response:
+            # Check for errors
+            if response.status_code != 200:
+                await response.aread()
+                logger.error(
+                    "Error from OpenRouter: %s - %s",
+                    response.status_code,
+                    response.text,
+                )
+                raise OpenRouterError(response.status_code, response.text)
+
+            # Accumulate the content deltas from the server-sent events
+            parts = []
+            finished = False
+            async for line in response.aiter_lines():
+                # Skip blank separators and comment lines used as keep-alives
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    finished = True
+                    break
+
+                chunk = orjson.loads(data)
+                if "error" in chunk:
+                    error = chunk["error"]
+                    raise OpenRouterError(
+                        error.get("code", 0), error.get("message", str(error))
+                    )
+
+                for choice in chunk.get("choices", ()):
+                    content = choice.get("delta", {}).get("content")
+                    if content:
+                        parts.append(content)
+                    if choice.get("finish_reason"):
+                        finished = True
+
+        # A stream cut off mid-reply would otherwise pass for a short answer
+        if not finished:
+            error_msg = "OpenRouter response stream ended before the reply was complete"
+            logger.error(error_msg)
+            raise OpenRouterError(0, error_msg)
+
+        logger.debug("Analysis completed successfully")
+
+        return "".join(parts)
+
+    except httpx.HTTPError as e:
+        error_msg = f"Network error when connecting to OpenRouter: {str(e)}"
+        logger.error(error_msg)
+        raise OpenRouterError(0, error_msg)
+    except orjson.JSONDecodeError as e:
+        error_msg = f"Error parsing OpenRouter response: {str(e)}"
+        logger.error(error_msg)
+        raise OpenRouterError(0, error_msg)
+
+
 @mcp.tool()
 async def image_analysis(
     image: str,
     query: str = "Describe this image in detail",
-    system_prompt: str = "You are an expert vision analyzer with exceptional attention to detail. Your purpose is to provide accurate, comprehensive descriptions of images that help AI agents understand visual content they cannot directly perceive. Focus on describing all relevant elements in the image - objects, people, text, colors, spatial relationships, actions, and context. Be precise but concise, organizing information from most to least important. Avoid making assumptions beyond what's visible and clearly indicate any uncertainty. When text appears in images, transcribe it verbatim within quotes. Respond only with factual descriptions without subjective judgments or creative embellishments. Your descriptions should enable an agent to make informed decisions based solely on your analysis.",
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT,
     model: Optional[str] = None,
-    max_tokens: int = 4000,
-    temperature: float = 0.7,
-    top_p: Optional[float] = None,
-    presence_penalty: Optional[float] = None,
-    frequency_penalty: Optional[float] = None,
+    max_tokens: Annotated[int, Field(ge=100, le=8000)] = 4000,
+    temperature: Annotated[float, Field(ge=0.0, le=1.0)] = 0.7,
+    top_p: Annotated[Optional[float], Field(ge=0.0, le=1.0)] = None,
+    presence_penalty: Annotated[Optional[float], Field(ge=0.0, le=2.0)] = None,
+    frequency_penalty: Annotated[Optional[float], Field(ge=0.0, le=2.0)] = None,
     project_root: Optional[str] = None,
+    force_inline: bool = False,
 ) -> str:
     """
     Analyze an image using OpenRouter's vision capabilities.
@@ -321,12 +939,14 @@ async def image_analysis(
                relevant and useful responses.
         system_prompt: Instructions for the model defining its role and behavior
         model: The vision model to use (defaults to the value set by OPENROUTER_DEFAULT_MODEL)
-        max_tokens: Maximum number of tokens in the response (100-4000)
+        max_tokens: Maximum number of tokens in the response (100-8000)
         temperature: Temperature parameter for generation (0.0-1.0)
         top_p: Optional nucleus sampling parameter (0.0-1.0)
         presence_penalty: Optional penalty for new tokens based on presence in text so far (0.0-2.0)
         frequency_penalty: Optional penalty for new tokens based on frequency in text so far (0.0-2.0)
         project_root: Optional root directory to resolve relative image paths against
+        force_inline: Download image URLs and send the image data instead of the URL.
+                      Use this for URLs that OpenRouter cannot reach, such as private hosts.
 
     Returns:
         The analysis result as text
@@ -356,49 +976,10 @@ async def image_analysis(
                 system_prompt="You are an expert at identifying objects in images. Focus on listing all visible objects."
             )
     """
-    # Validate parameter constraints
-    if max_tokens < 100 or max_tokens > 8000:
-        raise ValueError("max_tokens must be between 100 and 4000")
-
-    if temperature < 0.0 or temperature > 1.0:
-        raise ValueError("temperature must be between 0.0 and 1.0")
-
-    if top_p is not None and (top_p < 0.0 or top_p > 1.0):
-        raise ValueError("top_p must be between 0.0 and 1.0")
-
-    if presence_penalty is not None and (
-        presence_penalty < 0.0 or presence_penalty > 2.0
-    ):
-        raise ValueError("presence_penalty must be between 0.0 and 2.0")
-
-    if frequency_penalty is not None and (
-        frequency_penalty < 0.0 or frequency_penalty > 2.0
-    ):
-        raise ValueError("frequency_penalty must be between 0.0 and 2.0")
-
-    # Process the image input (URL, file path, or base64)
+    # Resolve the image input (URL, file path, or base64)
     try:
-        base64_image = process_image_input(image, project_root)
-        # Derive MIME type based on input
-        if image.startswith("data:image"):
-            mime_type = extract_mime_type_from_data_url(image)
-        elif is_url(image):
-            mime_type = get_mime_type(image)
-        elif is_base64(image):
-            mime_type = "image/jpeg"
-        else:
-            # Local path: sniff actual bytes to avoid mismatches between extension and content
-            try:
-                candidate_path = Path(image)
-                if not candidate_path.is_absolute() and project_root:
-                    candidate_path = Path(project_root) / image
-                with open(candidate_path, "rb") as f:
-                    header = f.read(16)
-                mime_type = get_mime_type(str(candidate_path), header)
-            except Exception:
-                # Fallback to extension-based guess
-                mime_type = get_mime_type(image)
-        print(f"Image processed successfully. Detected MIME type: {mime_type}")
+        image_url = await _image_url(image, project_root, force_inline)
+        logger.debug("Image processed successfully")
     except Exception as e:
         # Provide more helpful error message with examples
         error_msg = f"Failed to process image: {str(e)}\n\n"
@@ -431,87 +1012,190 @@ async def image_analysis(
     except ConfigurationError as e:
         raise
 
-    print(f"Processing image with model: {model_value}")
-
-    # Prepare messages for the OpenRouter request
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": query},
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:{mime_type};base64,{base64_image}"},
-                },
-            ],
-        },
-    ]
+    logger.debug("Processing image with model: %s", model_value)
+
+    use_cache = (
+        temperature <= RESPONSE_CACHE_MAX_TEMPERATURE and is_response_cache_enabled()
+    )
+    if use_cache:
+        cache_key = _response_cache_key(
+            image_url,
+            model=model_value,
+            system_prompt=system_prompt,
+            query=query,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            presence_penalty=presence_penalty,
+            frequency_penalty=frequency_penalty,
+        )
+        response_cache = (
+            _URL_RESPONSE_CACHE
+            if image_url.startswith(("http://", "https://"))
+            else _RESPONSE_CACHE
+        )
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Returning cached analysis")
+            return cached
+
+        # Identical requests arriving while one is already in flight wait for
+        # its result instead of sending a duplicate upstream call
+        while (pending := _IN_FLIGHT.get(cache_key)) is not None:
+            logger.debug("Waiting for identical request already in flight")
+            try:
+                return await asyncio.shield(pending)
+            except _RequestAbandoned:
+                # The caller that sent it was cancelled; this caller was not,
+                # so join a newer request or send its own
+                logger.debug("In-flight request was abandoned, retrying")
 
     # Prepare OpenRouter request
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://github.com/modelcontextprotocol/mcp-openvision",
-        "X-Title": "MCP OpenVision",
-    }
+    headers = _request_headers(api_key)
+
+    payload = _build_payload(
+        [image_url],
+        query,
+        system_prompt,
+        model_value,
+        max_tokens,
+        temperature,
+        top_p=top_p,
+        presence_penalty=presence_penalty,
+        frequency_penalty=frequency_penalty,
+    )
+
+    logger.debug("Sending request to OpenRouter...")
+
+    if not use_cache:
+        return await _request_analysis(headers, payload)
+
+    future = asyncio.get_running_loop().create_future()
+    _IN_FLIGHT[cache_key] = future
+    try:
+        analysis = await _request_analysis(headers, payload)
+    except asyncio.CancelledError:
+        # Only this caller was cancelled, so let any waiters retry rather
+        # than cancelling them too
+        future.set_exception(_RequestAbandoned())
+        future.exception()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Mark the exception as retrieved in case no other caller is waiting
+        future.exception()
+        raise
+    finally:
+        del _IN_FLIGHT[cache_key]
 
-    # Start with required parameters
-    payload = {
-        "model": model_value,
-        "messages": messages,
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-    }
+    if analysis:
+        response_cache.set(cache_key, analysis)
+    future.set_result(analysis)
+    return analysis
 
-    # Add optional parameters if provided
-    if top_p is not None:
-        payload["top_p"] = top_p
 
-    if presence_penalty is not None:
-        payload["presence_penalty"] = presence_penalty
+@mcp.tool()
+async def image_analysis_batch(
+    images: Annotated[List[str], Field(min_length=1, max_length=MAX_BATCH_SIZE)],
+    query: str = "Describe this image in detail",
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+    model: Optional[str] = None,
+    max_tokens: Annotated[int, Field(ge=100, le=8000)] = 4000,
+    temperature: Annotated[float, Field(ge=0.0, le=1.0)] = 0.7,
+    project_root: Optional[str] = None,
+    force_inline: bool = False,
+) -> List[str]:
+    """
+    Analyze several images with the same query in one tool call.
 
-    if frequency_penalty is not None:
-        payload["frequency_penalty"] = frequency_penalty
+    Each image is analyzed by its own OpenRouter request, and all requests run
+    concurrently over the shared connection, so a batch takes about as long as
+    its slowest image rather than the sum of all of them.
 
-    print("Sending request to OpenRouter...")
+    Args:
+        images: Up to 16 images, each as a base64-encoded string, URL, or local file path
+        query: Text prompt applied to every image
+        system_prompt: Instructions for the model defining its role and behavior
+        model: The vision model to use (defaults to the value set by OPENROUTER_DEFAULT_MODEL)
+        max_tokens: Maximum number of tokens in each response (100-8000)
+        temperature: Temperature parameter for generation (0.0-1.0)
+        project_root: Optional root directory to resolve relative image paths against
+        force_inline: Download image URLs and send the image data instead of the URL
 
-    try:
-        # Make the API call
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
-        )
+    Returns:
+        One analysis per image, in the order given. An image that fails is
+        reported as an "Error: ..." entry instead of failing the whole batch.
 
-        # Check for errors
-        if response.status_code != 200:
-            error_msg = (
-                f"Error from OpenRouter: {response.status_code} - {response.text}"
+    Examples:
+        image_analysis_batch(
+            images=["screens/login.png", "screens/signup.png"],
+            project_root="/path/to/project",
+            query="List every form field and button label shown on this screen"
+        )
+    """
+    results = await asyncio.gather(
+        *(
+            image_analysis(
+                image=image,
+                query=query,
+                system_prompt=system_prompt,
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                project_root=project_root,
+                force_inline=force_inline,
             )
-            print(error_msg)
-            raise OpenRouterError(response.status_code, response.text)
+            for image in images
+        ),
+        return_exceptions=True,
+    )
+    # gather also returns BaseExceptions such as CancelledError, which would
+    # otherwise land in the list and break serialization of the whole reply
+    return [
+        (
+            f"Error: {str(result) or type(result).__name__}"
+            if isinstance(result, BaseException)
+            else result
+        )
+        for result in results
+    ]
 
-        # Parse the response
-        result = response.json()
-        analysis = result["choices"][0]["message"]["content"]
 
-        print("Analysis completed successfully")
+def _resolve_log_level(value: str) -> Optional[int]:
+    """
+    Turn a log level name such as "debug", or a number such as "10", into a level.
 
-        return analysis
+    Args:
+        value: The level name or number
 
-    except requests.RequestException as e:
-        error_msg = f"Network error when connecting to OpenRouter: {str(e)}"
-        print(error_msg)
-        raise OpenRouterError(0, error_msg)
-    except json.JSONDecodeError as e:
-        error_msg = f"Error parsing OpenRouter response: {str(e)}"
-        print(error_msg)
-        raise OpenRouterError(0, error_msg)
+    Returns:
+        The numeric log level, or None if the value is not a known level
+    """
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value.upper())
+    return level if isinstance(level, int) else None
 
 
 def main():
     """Run the MCP server."""
+    log_setting = os.environ.get("MCP_OPENVISION_LOG", "WARNING")
+    level = _resolve_log_level(log_setting)
+
+    # Logs go to stderr, since stdout carries the MCP protocol. FastMCP has
+    # already configured the root logger at import, so replace its setup.
+    logging.basicConfig(
+        level=logging.WARNING if level is None else level,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        stream=sys.stderr,
+        force=True,
+    )
+    if level is None:
+        logger.warning(
+            "Unknown MCP_OPENVISION_LOG level %r, using WARNING", log_setting
+        )
+
     if sys.platform == "win32":
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
@@ -0,0 +1,66 @@
+"""Shared fixtures for the test suite."""
+
+import base64
+import os
+from unittest.mock import MagicMock
+
+import httpx
+import pytest
+
+from mcp_openvision.config import get_api_key
+
+
+@pytest.fixture(autouse=True, scope="module")
+def restore_environment():
+    """Undo any environment changes a test module leaves behind."""
+    snapshot = os.environ.copy()
+    yield
+    os.environ.clear()
+    os.environ.update(snapshot)
+
+
+@pytest.fixture(autouse=True)
+def mock_stream(monkeypatch):
+    """
+    Replace httpx streaming requests with a mock so no test reaches the network.
+
+    Tests that exercise HTTP calls take this fixture and set its return_value
+    or side_effect.
+    """
+    stream = MagicMock()
+    monkeypatch.setattr(httpx.AsyncClient, "stream", stream)
+    return stream
+
+
+@pytest.fixture
+def mock_api_key(monkeypatch):
+    """Set a mock API key for testing."""
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test_api_key")
+    get_api_key.cache_clear()
+    yield
+    get_api_key.cache_clear()
+
+
+@pytest.fixture(scope="session")
+def sample_image_file(tmp_path_factory):
+    """Create a dummy image file shared by the whole test session."""
+    image_path = tmp_path_factory.mktemp("images") / "sample.jpg"
+    image_path.write_bytes(b"dummy image content")
+    return str(image_path)
+
+
+@pytest.fixture(scope="session")
+def sample_image_b64(sample_image_file):
+    """Base64 encoding of the sample image file."""
+    with open(sample_image_file, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode("ascii")
+
+
+@pytest.fixture(scope="session")
+def sample_project_root(tmp_path_factory):
+    """Create a project directory holding subdir/test_image.jpg."""
+    project_root = tmp_path_factory.mktemp("project")
+    test_subdir = project_root / "subdir"
+    test_subdir.mkdir()
+    (test_subdir / "test_image.jpg").write_bytes(b"test image content")
+    return str(project_root)
@@ -0,0 +1,49 @@
+"""Tests for the in-memory caches."""
+
+from unittest.mock import patch
+
+from mcp_openvision.cache import LRUCache
+
+
+def test_lru_cache_get_and_set():
+    """Test storing and retrieving cached values."""
+    cache = LRUCache(maxsize=2)
+    assert cache.get("missing") is None
+
+    cache.set("a", "value a")
+    assert cache.get("a") == "value a"
+    assert len(cache) == 1
+
+    cache.clear()
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """Test that the least recently used entry is evicted when full."""
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    # Touch "a" so that "b" becomes the least recently used entry
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+@patch("mcp_openvision.cache.time.monotonic")
+def test_lru_cache_ttl_expiry(mock_monotonic):
+    """Test that entries expire once their time-to-live has passed."""
+    mock_monotonic.return_value = 100.0
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+
+    mock_monotonic.return_value = 105.0
+    assert cache.get("a") == 1
+
+    mock_monotonic.return_value = 110.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
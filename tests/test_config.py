@@ -2,41 +2,37 @@
 
 import os
 import pytest
-from mcp_openvision.config import get_api_key, get_default_model, VisionModel
+from mcp_openvision.config import (
+    DEFAULT_MAX_IMAGE_BYTES,
+    get_api_key,
+    get_default_model,
+    get_max_image_bytes,
+    VisionModel,
+)
 from mcp_openvision.exceptions import ConfigurationError
 
 
-@pytest.fixture
-def clear_env_vars():
-    """Remove environment variables before tests and restore after."""
-    # Save original values
-    original_api_key = os.environ.get("OPENROUTER_API_KEY")
-    original_model = os.environ.get("OPENROUTER_DEFAULT_MODEL")
-
-    # Clear environment variables
-    if "OPENROUTER_API_KEY" in os.environ:
-        del os.environ["OPENROUTER_API_KEY"]
-    if "OPENROUTER_DEFAULT_MODEL" in os.environ:
-        del os.environ["OPENROUTER_DEFAULT_MODEL"]
-
+@pytest.fixture(autouse=True)
+def clear_config_cache():
+    """Reset memoized configuration so each test reads the current environment."""
+    get_api_key.cache_clear()
+    get_default_model.cache_clear()
     yield
+    get_api_key.cache_clear()
+    get_default_model.cache_clear()
 
-    # Restore original values
-    if original_api_key:
-        os.environ["OPENROUTER_API_KEY"] = original_api_key
-    elif "OPENROUTER_API_KEY" in os.environ:
-        del os.environ["OPENROUTER_API_KEY"]
 
-    if original_model:
-        os.environ["OPENROUTER_DEFAULT_MODEL"] = original_model
-    elif "OPENROUTER_DEFAULT_MODEL" in os.environ:
-        del os.environ["OPENROUTER_DEFAULT_MODEL"]
+@pytest.fixture
+def clear_env_vars(monkeypatch):
+    """Remove environment variables for the duration of a test."""
+    monkeypatch.delenv("OPENROUTER_API_KEY", raising=False)
+    monkeypatch.delenv("OPENROUTER_DEFAULT_MODEL", raising=False)
 
 
-def test_get_api_key_from_env():
+def test_get_api_key_from_env(monkeypatch):
     """Test retrieving API key from environment variable."""
     # Set environment variable
-    os.environ["OPENROUTER_API_KEY"] = "test_api_key"
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test_api_key")
 
     # Get the API key
     api_key = get_api_key()
@@ -58,11 +54,11 @@ def test_get_api_key_missing(clear_env_vars):
     assert "OPENROUTER_API_KEY environment variable not set" in str(excinfo.value)
 
 
-def test_get_default_model_from_env():
+def test_get_default_model_from_env(monkeypatch):
     """Test retrieving default model from environment variable."""
     # Set environment variable to a valid model value
     valid_model = VisionModel.CLAUDE_3_SONNET.value
-    os.environ["OPENROUTER_DEFAULT_MODEL"] = valid_model
+    monkeypatch.setenv("OPENROUTER_DEFAULT_MODEL", valid_model)
 
     # Get the default model
     model = get_default_model()
@@ -71,11 +67,10 @@ def test_get_default_model_from_env():
     assert model == VisionModel.CLAUDE_3_SONNET
 
 
-def test_get_default_model_invalid():
+def test_get_default_model_invalid(monkeypatch):
     """Test behavior with an invalid model name."""
     # Set environment variable to an invalid model
-    original_value = os.environ.get("OPENROUTER_DEFAULT_MODEL")
-    os.environ["OPENROUTER_DEFAULT_MODEL"] = "invalid/model-name"
+    monkeypatch.setenv("OPENROUTER_DEFAULT_MODEL", "invalid/model-name")
 
     # Get the default model, should use fallback
     model = get_default_model()
@@ -83,12 +78,6 @@ def test_get_default_model_invalid():
     # Check that it returns the fallback model
     assert model == VisionModel.QWEN_QWQ_32B
 
-    # Restore original value if it existed
-    if original_value:
-        os.environ["OPENROUTER_DEFAULT_MODEL"] = original_value
-    else:
-        del os.environ["OPENROUTER_DEFAULT_MODEL"]
-
 
 def test_get_default_model_fallback(clear_env_vars):
     """Test fallback to default model when not set in environment."""
@@ -100,3 +89,21 @@ def test_get_default_model_fallback(clear_env_vars):
 
     # Check that it returns the fallback value
     assert model == VisionModel.QWEN_QWQ_32B
+
+
+def test_get_max_image_bytes(monkeypatch):
+    """Test reading the download size limit from the environment."""
+    monkeypatch.delenv("MCP_OPENVISION_MAX_BYTES", raising=False)
+    assert get_max_image_bytes() == DEFAULT_MAX_IMAGE_BYTES
+
+    monkeypatch.setenv("MCP_OPENVISION_MAX_BYTES", "1048576")
+    assert get_max_image_bytes() == 1048576
+
+
+@pytest.mark.parametrize("value", ["25MB", "-1", "0"])
+def test_get_max_image_bytes_invalid(monkeypatch, value):
+    """Test that a malformed size limit raises a clear configuration error."""
+    monkeypatch.setenv("MCP_OPENVISION_MAX_BYTES", value)
+    with pytest.raises(ConfigurationError) as excinfo:
+        get_max_image_bytes()
+    assert "MCP_OPENVISION_MAX_BYTES" in str(excinfo.value)
@@ -1,15 +1,27 @@
 """Tests for the MCP server implementation."""
 
+import asyncio
+import base64
+import io
 import json
+import logging
 import os
-import requests
+import httpx
 import pytest
-import tempfile
-from pathlib import Path
-from unittest.mock import patch, MagicMock
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+from unittest.mock import patch
 
+from mcp.server.fastmcp.exceptions import ToolError
+from PIL import Image
+
+from mcp_openvision import server
 from mcp_openvision.server import (
+    MAX_IMAGE_DIMENSION,
+    PNG_REENCODE_MIN_BYTES,
+    get_mime_type,
     image_analysis,
+    image_analysis_batch,
     mcp,
     is_url,
     is_base64,
@@ -17,45 +29,80 @@ from mcp_openvision.server import (
     load_image_from_url,
     load_image_from_path,
 )
+from mcp_openvision.config import DEFAULT_MAX_IMAGE_BYTES
 from mcp_openvision.exceptions import OpenRouterError
 
 
-@pytest.fixture
-def mock_api_key():
-    """Set a mock API key for testing."""
-    original_key = os.environ.get("OPENROUTER_API_KEY")
-    os.environ["OPENROUTER_API_KEY"] = "test_api_key"
-    yield
-    if original_key:
-        os.environ["OPENROUTER_API_KEY"] = original_key
-    else:
-        del os.environ["OPENROUTER_API_KEY"]
+@dataclass(slots=True)
+class FakeResponse:
+    """Minimal stand-in for an HTTP response object."""
 
+    status_code: int = 200
+    payload: Any = None
+    text: str = ""
+    content: bytes = b""
+    headers: Dict[str, str] = field(default_factory=dict)
+    lines: List[str] = field(default_factory=list)
+    delay: float = 0
 
-@pytest.fixture
-def sample_image_file():
-    """Create a temporary image file for testing."""
-    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
-        # Write some dummy image content
-        tmp.write(b"dummy image content")
-        tmp.flush()
-        yield tmp.name
-    # Clean up the file after the test
-    try:
-        os.unlink(tmp.name)
-    except Exception:
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        pass
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.delay)
+        return self
+
+    async def __aexit__(self, *exc_info):
         pass
 
+    async def aread(self):
+        return self.content
+
+    async def aiter_lines(self):
+        for line in self.lines:
+            yield line
+
+    async def aiter_bytes(self, chunk_size=None):
+        chunk_size = chunk_size or len(self.content) or 1
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start : start + chunk_size]
+
+
+def sse_response(*contents: str, **kwargs) -> FakeResponse:
+    """Build a streamed OpenRouter response delivering `contents` as deltas."""
+    lines = [": OPENROUTER PROCESSING", ""]
+    for content in contents:
+        chunk = {"choices": [{"delta": {"content": content}}]}
+        lines += [f"data: {json.dumps(chunk)}", ""]
+    lines.append("data: [DONE]")
+    return FakeResponse(lines=lines, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start every test with empty in-memory caches."""
+    server._BASE64_CACHE.clear()
+    server._URL_CACHE.clear()
+    server._PATH_CACHE.clear()
+    server._RESPONSE_CACHE.clear()
+    server._URL_RESPONSE_CACHE.clear()
+    yield
+
 
 def test_is_url():
     """Test the is_url function."""
     assert is_url("http://example.com/image.jpg") is True
     assert is_url("https://example.com/image.jpg") is True
     assert is_url("ftp://example.com/image.jpg") is True
+    assert is_url("HTTPS://example.com/image.jpg") is True
     assert is_url("example.com") is False
     assert is_url("/path/to/image.jpg") is False
     assert is_url("image.jpg") is False
     assert is_url("data:image/jpeg;base64,abc123") is False
+    assert is_url("s3://bucket/image.jpg") is False
 
 
 def test_is_base64():
@@ -73,87 +120,271 @@ def test_is_base64():
     assert is_base64("http://example.com") is False
     assert is_base64("/path/to/image.jpg") is False
 
+    # Large payloads are checked at both ends
+    large = base64.b64encode(b"\x00" * 100_000).decode("ascii")
+    assert is_base64(large) is True
+    assert is_base64(large[:-4] + "ab!=") is False
+
+
+@pytest.mark.parametrize(
+    "image_data, expected",
+    [
+        (b"\x89PNG\r\n\x1a\n" + b"\x00" * 8, "image/png"),
+        (b"\xff\xd8\xff\xe0" + b"\x00" * 8, "image/jpeg"),
+        (b"RIFF\x00\x00\x00\x00WEBPVP8 ", "image/webp"),
+        (b"GIF89a" + b"\x00" * 6, "image/gif"),
+    ],
+)
+def test_get_mime_type_prefers_signature(image_data, expected):
+    """Test that image signatures take precedence over the file extension."""
+    assert get_mime_type("image.jpg", image_data) == expected
+    assert get_mime_type("image.bin", image_data) == expected
+    assert get_mime_type("image.bin", bytearray(image_data)) == expected
+
+
+@pytest.mark.asyncio
+async def test_process_image_input_sniffs_plain_base64():
+    """Test that plain base64 input is labelled with its real image type."""
+    png = base64.b64encode(b"\x89PNG\r\n\x1a\n" + b"\x00" * 16).decode("ascii")
+    assert await process_image_input(png) == (png, "image/png")
+
 
-@patch("mcp_openvision.server.requests.get")
-def test_load_image_from_url(mock_get):
+@pytest.mark.asyncio
+@patch("mcp_openvision.server.DOWNLOAD_CHUNK_SIZE", 4)
+async def test_load_image_from_url(mock_stream):
     """Test loading an image from a URL."""
     # Mock the response
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.content = b"dummy image content"
-    mock_get.return_value = mock_response
+    mock_response = FakeResponse(content=b"dummy image content")
+    mock_stream.return_value = mock_response
 
     # Test successful URL loading
-    base64_result = load_image_from_url("http://example.com/image.jpg")
-    assert isinstance(base64_result, str)
+    base64_result, mime_type = await load_image_from_url("http://example.com/image.jpg")
+    assert base64.b64decode(base64_result) == b"dummy image content"
+    assert mime_type == "image/jpeg"
 
     # Test URL loading error
     mock_response.status_code = 404
     with pytest.raises(Exception):
-        load_image_from_url("http://example.com/not-found.jpg")
+        await load_image_from_url("http://example.com/not-found.jpg")
+
+
+@pytest.mark.asyncio
+async def test_load_image_from_url_cached(mock_stream):
+    """Test that repeated downloads of the same URL are served from the cache."""
+    mock_response = FakeResponse(
+        content=b"dummy image content", headers={"Content-Type": "image/jpeg"}
+    )
+    mock_stream.return_value = mock_response
+
+    url = "http://example.com/cached.jpg"
+    first = await load_image_from_url(url)
+    second = await load_image_from_url(url)
+
+    assert first == second
+    mock_stream.assert_called_once()
+
+    # Responses marked as uncacheable are fetched every time
+    mock_stream.reset_mock()
+    mock_response.headers = {"Content-Type": "image/jpeg", "Cache-Control": "no-store"}
+    url = "http://example.com/uncached.jpg"
+    await load_image_from_url(url)
+    await load_image_from_url(url)
+    assert mock_stream.call_count == 2
 
 
-def test_load_image_from_path(sample_image_file):
+@pytest.mark.asyncio
+async def test_load_image_from_url_rejected(mock_stream):
+    """Test that oversized or non-image downloads are refused."""
+    mock_stream.return_value = FakeResponse(
+        content=b"<html></html>", headers={"Content-Type": "text/html"}
+    )
+    with pytest.raises(Exception, match="does not point to an image"):
+        await load_image_from_url("http://example.com/page.html")
+
+    mock_stream.return_value = FakeResponse(
+        content=b"x", headers={"Content-Length": str(DEFAULT_MAX_IMAGE_BYTES + 1)}
+    )
+    with pytest.raises(Exception, match="too large"):
+        await load_image_from_url("http://example.com/huge.jpg")
+
+    # A body that outgrows the limit without announcing its length
+    with patch.dict(os.environ, {"MCP_OPENVISION_MAX_BYTES": "4"}):
+        mock_stream.return_value = FakeResponse(content=b"dummy image content")
+        with pytest.raises(Exception, match="too large"):
+            await load_image_from_url("http://example.com/unsized.jpg")
+
+
+def test_load_image_from_path(sample_image_file, sample_image_b64, sample_project_root):
     """Test loading an image from a file path."""
     # Test with a valid file
-    base64_result = load_image_from_path(sample_image_file)
-    assert isinstance(base64_result, str)
+    base64_result, mime_type = load_image_from_path(sample_image_file)
+    assert base64_result == sample_image_b64
+    assert mime_type == "image/jpeg"
 
     # Test with a non-existent file
     with pytest.raises(FileNotFoundError):
         load_image_from_path("/path/to/nonexistent/image.jpg")
 
-    # Create a test directory structure for project_root testing
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Create a test file within a subdirectory
-        test_subdir = Path(temp_dir) / "subdir"
-        test_subdir.mkdir()
-        test_file = test_subdir / "test_image.jpg"
-        with open(test_file, "wb") as f:
-            f.write(b"test image content")
-
-        # Test with project_root and relative path
-        base64_result = load_image_from_path(
-            "subdir/test_image.jpg", project_root=temp_dir
-        )
-        assert isinstance(base64_result, str)
-
-        # Test with project_root but invalid path
-        with pytest.raises(FileNotFoundError) as excinfo:
-            load_image_from_path("non_existent.jpg", project_root=temp_dir)
-        assert "tried directly and under project root" in str(excinfo.value)
-
-        # Test with relative path but no project_root
-        with pytest.raises(FileNotFoundError) as excinfo:
-            load_image_from_path("some/relative/path.jpg")
-        assert "relative path used without specifying project_root" in str(
-            excinfo.value
-        )
+    # Test with project_root and relative path
+    base64_result, _ = load_image_from_path(
+        "subdir/test_image.jpg", project_root=sample_project_root
+    )
+    assert isinstance(base64_result, str)
 
+    # A project_root that resolves to the same candidate is only tried once
+    with patch(
+        "mcp_openvision.server._read_image_file",
+        side_effect=FileNotFoundError,
+    ) as mock_read:
+        with pytest.raises(FileNotFoundError):
+            load_image_from_path("missing.jpg", project_root=".")
+    mock_read.assert_called_once_with("missing.jpg")
+
+    # Test with project_root but invalid path
+    with pytest.raises(FileNotFoundError) as excinfo:
+        load_image_from_path("non_existent.jpg", project_root=sample_project_root)
+    assert "tried directly and under project root" in str(excinfo.value)
+
+    # Test with relative path but no project_root
+    with pytest.raises(FileNotFoundError) as excinfo:
+        load_image_from_path("some/relative/path.jpg")
+    assert "relative path used without specifying project_root" in str(excinfo.value)
+
+
+def test_load_image_from_path_cached(tmp_path):
+    """Test that unchanged files are only read and encoded once."""
+    image_path = tmp_path / "cached.jpg"
+    image_path.write_bytes(b"first version")
+
+    with patch(
+        "mcp_openvision.server._encode_for_upload",
+        wraps=server._encode_for_upload,
+    ) as mock_encode:
+        first = load_image_from_path(str(image_path))
+        second = load_image_from_path(str(image_path))
+        assert first == second
+        mock_encode.assert_called_once()
+
+        # Modifying the file invalidates the cached entry
+        image_path.write_bytes(b"second, longer version")
+        third = load_image_from_path(str(image_path))
+        assert base64.b64decode(third[0]) == b"second, longer version"
+        assert mock_encode.call_count == 2
+
+
+@pytest.mark.parametrize("use_opencv", [True, False])
+def test_load_image_from_path_reencodes_large_png(tmp_path, monkeypatch, use_opencv):
+    """Test that large PNGs are re-encoded as JPEG while small ones are kept."""
+    if use_opencv and server.cv2 is None:
+        pytest.skip("OpenCV is not installed")
+    if not use_opencv:
+        monkeypatch.setattr(server, "cv2", None)
+
+    # Random noise compresses poorly, which keeps the PNG above the threshold
+    large_png = tmp_path / "large.png"
+    Image.frombytes("RGB", (400, 400), os.urandom(400 * 400 * 3)).save(large_png)
+    assert large_png.stat().st_size > PNG_REENCODE_MIN_BYTES
+
+    base64_result, mime_type = load_image_from_path(str(large_png))
+    assert mime_type == "image/jpeg"
+    assert base64.b64decode(base64_result).startswith(b"\xff\xd8\xff")
+
+    small_png = tmp_path / "small.png"
+    Image.new("RGB", (16, 16), (255, 0, 0)).save(small_png)
+
+    base64_result, mime_type = load_image_from_path(str(small_png))
+    assert mime_type == "image/png"
+    assert base64.b64decode(base64_result) == small_png.read_bytes()
+
+
+@pytest.mark.parametrize("use_opencv", [True, False])
+def test_load_image_from_path_downscales_large_images(
+    tmp_path, monkeypatch, use_opencv
+):
+    """Test that images above the maximum dimension are downscaled."""
+    if use_opencv and server.cv2 is None:
+        pytest.skip("OpenCV is not installed")
+    if not use_opencv:
+        monkeypatch.setattr(server, "cv2", None)
+
+    wide_image = tmp_path / "wide.jpg"
+    Image.new("RGB", (MAX_IMAGE_DIMENSION * 2, 100), (0, 128, 255)).save(wide_image)
+
+    base64_result, mime_type = load_image_from_path(str(wide_image))
+    assert mime_type == "image/jpeg"
+    with Image.open(io.BytesIO(base64.b64decode(base64_result))) as img:
+        assert img.size == (MAX_IMAGE_DIMENSION, 50)
+
+
+@pytest.mark.parametrize("use_opencv", [True, False])
+def test_load_image_from_path_applies_exif_orientation(
+    tmp_path, monkeypatch, use_opencv
+):
+    """Test that rotated photos are uploaded upright after re-encoding."""
+    if use_opencv and server.cv2 is None:
+        pytest.skip("OpenCV is not installed")
+    if not use_opencv:
+        monkeypatch.setattr(server, "cv2", None)
+
+    # Stored landscape, tagged to be rotated 90 degrees clockwise for display
+    exif = Image.Exif()
+    exif[server._EXIF_ORIENTATION] = 6
+    photo = tmp_path / "portrait.jpg"
+    Image.new("RGB", (MAX_IMAGE_DIMENSION * 2, 100), (0, 128, 255)).save(
+        photo, exif=exif
+    )
 
+    base64_result, mime_type = load_image_from_path(str(photo))
+    assert mime_type == "image/jpeg"
+    with Image.open(io.BytesIO(base64.b64decode(base64_result))) as img:
+        assert img.size == (50, MAX_IMAGE_DIMENSION)
+        assert img.getexif().get(server._EXIF_ORIENTATION, 1) == 1
+
+
+@pytest.mark.parametrize(
+    "image, kind",
+    [
+        ("data:image/png;base64,SGVsbG8gV29ybGQ=", "data_url"),
+        ("https://example.com/image.jpg", "url"),
+        ("ftp://example.com/image.jpg", "url"),
+        ("SGVsbG8gV29ybGQ=", "base64"),
+        ("/path/to/image.jpg", "path"),
+        ("relative/image.png", "path"),
+    ],
+)
+def test_classify_image_input(image, kind):
+    """Test that each kind of image input is recognised."""
+    assert server._classify_image_input(image) == kind
+
+
+@pytest.mark.asyncio
 @patch("mcp_openvision.server.load_image_from_url")
 @patch("mcp_openvision.server.load_image_from_path")
-def test_process_image_input(mock_load_path, mock_load_url):
+async def test_process_image_input(mock_load_path, mock_load_url):
     """Test the process_image_input function."""
     # Setup mocks
-    mock_load_url.return_value = "base64_from_url"
-    mock_load_path.return_value = "base64_from_path"
+    mock_load_url.return_value = ("base64_from_url", "image/png")
+    mock_load_path.return_value = ("base64_from_path", "image/jpeg")
 
     # Test with base64 input
     base64_input = "SGVsbG8gV29ybGQ="  # Valid base64
-    result = process_image_input(base64_input)
-    assert result == base64_input
+    result = await process_image_input(base64_input)
+    assert result == (base64_input, "image/jpeg")
+
+    # Test with data URL input
+    result = await process_image_input(f"data:image/webp;base64,{base64_input}")
+    assert result == (base64_input, "image/webp")
 
     # Test with URL input
     url_input = "http://example.com/image.jpg"
-    result = process_image_input(url_input)
-    assert result == "base64_from_url"
+    result = await process_image_input(url_input)
+    assert result == ("base64_from_url", "image/png")
     mock_load_url.assert_called_once_with(url_input)
 
     # Test with path input (no project_root)
     path_input = "/path/to/image.jpg"
-    result = process_image_input(path_input)
-    assert result == "base64_from_path"
+    result = await process_image_input(path_input)
+    assert result == ("base64_from_path", "image/jpeg")
     mock_load_path.assert_called_once_with(path_input, None)
 
     # Reset mocks for next test
@@ -162,139 +393,276 @@ def test_process_image_input(mock_load_path, mock_load_url):
     # Test with path input and project_root
     path_input = "relative/path/to/image.jpg"
     project_root = "/app/root"
-    result = process_image_input(path_input, project_root)
-    assert result == "base64_from_path"
+    result = await process_image_input(path_input, project_root)
+    assert result == ("base64_from_path", "image/jpeg")
     mock_load_path.assert_called_once_with(path_input, project_root)
 
     # Test with invalid input
     mock_load_path.side_effect = FileNotFoundError("File not found")
     with pytest.raises(ValueError):
-        process_image_input("invalid_input")
+        await process_image_input("invalid_input")
+
+
+def test_build_payload():
+    """Test building a request body for several images."""
+    payload = server._build_payload(
+        ["data:image/png;base64,AAAA", "data:image/jpeg;base64,BBBB"],
+        "Compare these",
+        "You are helpful",
+        "some/model",
+        1000,
+        0.2,
+        top_p=0.9,
+        presence_penalty=None,
+    )
+
+    assert payload["model"] == "some/model"
+    assert payload["top_p"] == 0.9
+    assert "presence_penalty" not in payload
+    content = payload["messages"][1]["content"]
+    assert content[0] == {"type": "text", "text": "Compare these"}
+    assert [part["image_url"]["url"] for part in content[1:]] == [
+        "data:image/png;base64,AAAA",
+        "data:image/jpeg;base64,BBBB",
+    ]
 
 
 @pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "image, project_root, kind",
+    [
+        ("/path/to/image.jpg", None, "path"),
+        ("examples/test_image.png", "/path/to/project", "path"),
+        ("SGVsbG8gV29ybGQ=", None, "base64"),
+    ],
+)
 @patch("mcp_openvision.server.process_image_input")
-@patch("requests.post")
-async def test_image_analysis_with_file_path(mock_post, mock_process, mock_api_key):
-    """Test image analysis with a file path."""
+async def test_image_analysis(
+    mock_process, mock_stream, mock_api_key, image, project_root, kind
+):
+    """Test image analysis with inputs that are loaded and inlined."""
     # Set up mocks
-    mock_process.return_value = "base64_encoded_image"
+    mock_process.return_value = ("base64_encoded_image", "image/jpeg")
 
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = {
-        "choices": [{"message": {"content": "This is a test image analysis result."}}]
-    }
-    mock_post.return_value = mock_response
+    mock_stream.return_value = sse_response("This is a test ", "image analysis result.")
 
-    # Call the function with a file path
-    result = await image_analysis(image="/path/to/image.jpg", query="Test prompt")
+    kwargs = {"project_root": project_root} if project_root else {}
+    result = await image_analysis(image=image, query="Test prompt", **kwargs)
 
     # Verify the result
     assert result == "This is a test image analysis result."
 
     # Verify the image was processed
-    mock_process.assert_called_once_with("/path/to/image.jpg", None)
+    mock_process.assert_called_once_with(image, project_root, kind)
 
     # Verify the API was called correctly
-    mock_post.assert_called_once()
+    mock_stream.assert_called_once()
 
 
 @pytest.mark.asyncio
 @patch("mcp_openvision.server.process_image_input")
-@patch("requests.post")
-async def test_image_analysis_with_project_root(mock_post, mock_process, mock_api_key):
-    """Test image analysis with a file path and project root."""
+async def test_image_analysis_with_url(mock_process, mock_stream, mock_api_key):
+    """Test image analysis with a URL."""
     # Set up mocks
-    mock_process.return_value = "base64_encoded_image"
+    mock_process.return_value = ("base64_encoded_image", "image/jpeg")
 
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = {
-        "choices": [{"message": {"content": "This is a test image analysis result."}}]
-    }
-    mock_post.return_value = mock_response
+    mock_stream.return_value = sse_response("This is a test ", "image analysis result.")
 
-    # Call the function with a file path and project root
+    # Call the function with a URL
     result = await image_analysis(
-        image="examples/test_image.png",
-        project_root="/path/to/project",
-        query="Test prompt",
+        image="http://example.com/image.jpg", query="Test prompt"
     )
 
     # Verify the result
     assert result == "This is a test image analysis result."
 
-    # Verify the image was processed with project_root
-    mock_process.assert_called_once_with("examples/test_image.png", "/path/to/project")
+    # Verify the URL was forwarded rather than downloaded
+    mock_process.assert_not_called()
+    mock_stream.assert_called_once()
+    payload = json.loads(mock_stream.call_args.kwargs["content"])
+    image_part = payload["messages"][1]["content"][1]
+    assert image_part["image_url"]["url"] == "http://example.com/image.jpg"
 
-    # Verify the API was called correctly
-    mock_post.assert_called_once()
+
+@pytest.mark.asyncio
+@patch("mcp_openvision.server.process_image_input")
+async def test_image_analysis_with_url_force_inline(
+    mock_process, mock_stream, mock_api_key
+):
+    """Test that force_inline downloads URLs instead of forwarding them."""
+    mock_process.return_value = ("base64_encoded_image", "image/png")
+    mock_stream.return_value = sse_response("This is a test image analysis result.")
+
+    await image_analysis(
+        image="http://example.com/image.png", query="Test prompt", force_inline=True
+    )
+
+    mock_process.assert_called_once_with("http://example.com/image.png", None, "url")
+    payload = json.loads(mock_stream.call_args.kwargs["content"])
+    image_part = payload["messages"][1]["content"][1]
+    assert (
+        image_part["image_url"]["url"] == "data:image/png;base64,base64_encoded_image"
+    )
 
 
 @pytest.mark.asyncio
 @patch("mcp_openvision.server.process_image_input")
-@patch("requests.post")
-async def test_image_analysis_with_url(mock_post, mock_process, mock_api_key):
-    """Test image analysis with a URL."""
-    # Set up mocks
-    mock_process.return_value = "base64_encoded_image"
+async def test_image_analysis_with_data_url(mock_process, mock_stream, mock_api_key):
+    """Test that data URLs are sent to OpenRouter unchanged."""
+    data_url = "data:image/png;base64,SGVsbG8gV29ybGQ="
+    mock_stream.return_value = sse_response("This is a test image analysis result.")
 
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = {
-        "choices": [{"message": {"content": "This is a test image analysis result."}}]
-    }
-    mock_post.return_value = mock_response
+    result = await image_analysis(image=data_url, query="Test prompt")
 
-    # Call the function with a URL
-    result = await image_analysis(
-        image="http://example.com/image.jpg", query="Test prompt"
+    assert result == "This is a test image analysis result."
+    mock_process.assert_not_called()
+    payload = json.loads(mock_stream.call_args.kwargs["content"])
+    assert payload["messages"][1]["content"][1]["image_url"]["url"] == data_url
+
+
+@pytest.mark.asyncio
+@patch("mcp_openvision.server.process_image_input")
+async def test_image_analysis_cached_response(mock_process, mock_stream, mock_api_key):
+    """Test that repeating an identical request is served from the cache."""
+    mock_process.return_value = ("base64_encoded_image", "image/jpeg")
+    mock_stream.side_effect = lambda *args, **kwargs: sse_response(
+        "Cached analysis result."
     )
 
-    # Verify the result
-    assert result == "This is a test image analysis result."
+    first = await image_analysis(
+        image="/path/to/image.jpg", query="Test prompt", temperature=0.2
+    )
+    second = await image_analysis(
+        image="/path/to/image.jpg", query="Test prompt", temperature=0.2
+    )
 
-    # Verify the image was processed
-    mock_process.assert_called_once_with("http://example.com/image.jpg", None)
+    assert first == second == "Cached analysis result."
+    mock_stream.assert_called_once()
 
-    # Verify the API was called correctly
-    mock_post.assert_called_once()
+    # A different query is a different request
+    await image_analysis(
+        image="/path/to/image.jpg", query="Another prompt", temperature=0.2
+    )
+    assert mock_stream.call_count == 2
+
+    # High-temperature output is not deterministic enough to reuse
+    await image_analysis(image="/path/to/image.jpg", query="Test prompt")
+    await image_analysis(image="/path/to/image.jpg", query="Test prompt")
+    assert mock_stream.call_count == 4
+
+    # Caching can be disabled through the environment
+    with patch.dict(os.environ, {"MCP_OPENVISION_CACHE": "0"}):
+        await image_analysis(
+            image="/path/to/image.jpg", query="Test prompt", temperature=0.2
+        )
+    assert mock_stream.call_count == 5
+
+
+@pytest.mark.asyncio
+async def test_image_analysis_forwarded_url_cached_briefly(mock_stream, mock_api_key):
+    """Test that results for forwarded URLs use the short-lived cache."""
+    mock_stream.side_effect = lambda *args, **kwargs: sse_response("URL result.")
+    url = "https://example.com/latest.png"
+
+    await image_analysis(image=url, query="Test prompt", temperature=0)
+    await image_analysis(image=url, query="Test prompt", temperature=0)
+
+    mock_stream.assert_called_once()
+    assert len(server._URL_RESPONSE_CACHE) == 1
+    assert len(server._RESPONSE_CACHE) == 0
+    assert server._URL_RESPONSE_CACHE.ttl <= server._URL_CACHE.ttl
 
 
 @pytest.mark.asyncio
 @patch("mcp_openvision.server.process_image_input")
-@patch("requests.post")
-async def test_image_analysis_with_base64(mock_post, mock_process, mock_api_key):
-    """Test image analysis with base64 data."""
-    # Set up mocks
-    base64_image = "SGVsbG8gV29ybGQ="  # Valid base64
-    mock_process.return_value = base64_image
+async def test_image_analysis_coalesces_concurrent_requests(
+    mock_process, mock_stream, mock_api_key
+):
+    """Test that identical concurrent requests share one upstream call."""
+    mock_process.return_value = ("base64_encoded_image", "image/jpeg")
+
+    mock_stream.return_value = sse_response("Shared result.", delay=0.01)
+
+    results = await asyncio.gather(
+        *(
+            image_analysis(
+                image="/path/to/image.jpg", query="Test prompt", temperature=0.2
+            )
+            for _ in range(3)
+        )
+    )
 
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.json.return_value = {
-        "choices": [{"message": {"content": "This is a test image analysis result."}}]
-    }
-    mock_post.return_value = mock_response
+    assert results == ["Shared result."] * 3
+    mock_stream.assert_called_once()
+    assert not server._IN_FLIGHT
 
-    # Call the function with base64 data
-    result = await image_analysis(image=base64_image, query="Test prompt")
 
-    # Verify the result
-    assert result == "This is a test image analysis result."
+@pytest.mark.asyncio
+@patch("mcp_openvision.server.process_image_input")
+async def test_image_analysis_coalesced_caller_survives_owner_cancel(
+    mock_process, mock_stream, mock_api_key
+):
+    """Test that cancelling the first caller does not cancel those waiting on it."""
+    mock_process.return_value = ("base64_encoded_image", "image/jpeg")
+    mock_stream.side_effect = lambda *args, **kwargs: sse_response(
+        "Own result.", delay=0.05
+    )
 
-    # Verify the image was processed
-    mock_process.assert_called_once_with(base64_image, None)
+    kwargs = dict(image="/path/to/image.jpg", query="Test prompt", temperature=0)
+    owner = asyncio.create_task(image_analysis(**kwargs))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(image_analysis(**kwargs))
+    await asyncio.sleep(0.01)
 
-    # Verify the API was called correctly
-    mock_post.assert_called_once()
+    owner.cancel()
+    assert await waiter == "Own result."
+    assert owner.cancelled()
+    assert mock_stream.call_count == 2
+    assert not server._IN_FLIGHT
 
 
 @pytest.mark.asyncio
 @patch("mcp_openvision.server.process_image_input")
-@patch("requests.post")
-async def test_image_analysis_processing_error(mock_post, mock_process, mock_api_key):
+async def test_image_analysis_batch(mock_process, mock_stream, mock_api_key):
+    """Test analyzing several images concurrently in one call."""
+
+    async def process(image, project_root, kind):
+        if image == "missing.jpg":
+            raise FileNotFoundError("Image file not found")
+        return f"base64_{image}", "image/jpeg"
+
+    mock_process.side_effect = process
+    mock_stream.side_effect = lambda *args, **kwargs: sse_response("Batch result.")
+
+    results = await image_analysis_batch(
+        images=["one.jpg", "missing.jpg", "two.jpg"], query="Test prompt"
+    )
+
+    assert results[0] == results[2] == "Batch result."
+    assert results[1].startswith("Error: Failed to process image")
+    assert mock_stream.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_image_analysis_batch_cancelled_entry():
+    """Test that a cancelled entry is reported as an error string."""
+
+    async def analyze(image, **kwargs):
+        if image == "cancelled.jpg":
+            raise asyncio.CancelledError()
+        return f"Result for {image}"
+
+    with patch.object(server, "image_analysis", side_effect=analyze):
+        results = await image_analysis_batch(
+            images=["one.jpg", "cancelled.jpg"], query="Test prompt"
+        )
+
+    assert results == ["Result for one.jpg", "Error: CancelledError"]
+
+
+@pytest.mark.asyncio
+@patch("mcp_openvision.server.process_image_input")
+async def test_image_analysis_processing_error(mock_process, mock_stream, mock_api_key):
     """Test error handling when image processing fails."""
     # Set up mock to raise an exception
     mock_process.side_effect = ValueError("Invalid image")
@@ -307,18 +675,34 @@ async def test_image_analysis_processing_error(mock_post, mock_process, mock_api
     assert "Failed to process image" in str(excinfo.value)
 
     # Verify the API was not called
-    mock_post.assert_not_called()
+    mock_stream.assert_not_called()
 
 
 @pytest.mark.asyncio
-@patch("requests.post")
-async def test_image_analysis_api_error(mock_post, mock_api_key):
+@pytest.mark.parametrize(
+    "arguments",
+    [
+        {"max_tokens": 50},
+        {"max_tokens": 9000},
+        {"temperature": 1.5},
+        {"top_p": -0.1},
+        {"presence_penalty": 2.5},
+        {"frequency_penalty": -1.0},
+    ],
+)
+async def test_image_analysis_rejects_out_of_range_arguments(arguments):
+    """Test that the tool schema rejects out-of-range sampling parameters."""
+    with pytest.raises(ToolError) as excinfo:
+        await mcp.call_tool("image_analysis", {"image": "image.jpg", **arguments})
+
+    assert next(iter(arguments)) in str(excinfo.value)
+
+
+@pytest.mark.asyncio
+async def test_image_analysis_api_error(mock_stream, mock_api_key):
     """Test API error handling."""
     # Set up the mock response
-    mock_response = MagicMock()
-    mock_response.status_code = 401
-    mock_response.text = "Unauthorized"
-    mock_post.return_value = mock_response
+    mock_stream.return_value = FakeResponse(status_code=401, text="Unauthorized")
 
     # Call the function and verify it raises an OpenRouterError
     with pytest.raises(OpenRouterError) as excinfo:
@@ -332,11 +716,50 @@ async def test_image_analysis_api_error(mock_post, mock_api_key):
 
 
 @pytest.mark.asyncio
-@patch("requests.post")
-async def test_image_analysis_network_error(mock_post, mock_api_key):
+async def test_image_analysis_stream_error(mock_stream, mock_api_key):
+    """Test that an error event in the middle of the stream is raised."""
+    error = {"error": {"code": 502, "message": "Provider disconnected"}}
+    mock_stream.return_value = FakeResponse(lines=[f"data: {json.dumps(error)}"])
+
+    with pytest.raises(OpenRouterError) as excinfo:
+        await image_analysis(image="SGVsbG8gV29ybGQ=", query="Test prompt")
+
+    assert excinfo.value.status_code == 502
+    assert "Provider disconnected" in str(excinfo.value)
+
+
+@pytest.mark.asyncio
+async def test_image_analysis_truncated_stream(mock_stream, mock_api_key):
+    """Test that a stream cut off before [DONE] is an error, not a short answer."""
+    truncated = sse_response("Partial ")
+    truncated.lines = truncated.lines[:-1]
+    mock_stream.return_value = truncated
+
+    with pytest.raises(OpenRouterError, match="ended before the reply"):
+        await image_analysis(
+            image="SGVsbG8gV29ybGQ=", query="Test prompt", temperature=0
+        )
+    assert len(server._RESPONSE_CACHE) == 0
+
+
+@pytest.mark.asyncio
+async def test_image_analysis_empty_reply_not_cached(mock_stream, mock_api_key):
+    """Test that an empty analysis is returned but never cached."""
+    mock_stream.side_effect = lambda *args, **kwargs: sse_response()
+
+    for _ in range(2):
+        result = await image_analysis(
+            image="SGVsbG8gV29ybGQ=", query="Test prompt", temperature=0
+        )
+        assert result == ""
+    assert mock_stream.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_image_analysis_network_error(mock_stream, mock_api_key):
     """Test network error handling."""
-    # Set up the mock to raise a requests.RequestException
-    mock_post.side_effect = requests.RequestException("Connection error")
+    # Set up the mock to raise an httpx.ConnectError
+    mock_stream.side_effect = httpx.ConnectError("Connection error")
 
     # Call the function and verify it raises an OpenRouterError
     with pytest.raises(OpenRouterError) as excinfo:
@@ -347,3 +770,56 @@ async def test_image_analysis_network_error(mock_post, mock_api_key):
     # Verify error details
     assert excinfo.value.status_code == 0
     assert "Connection error" in str(excinfo.value)
+
+
+@pytest.mark.parametrize(
+    "value, level",
+    [
+        ("DEBUG", logging.DEBUG),
+        ("info", logging.INFO),
+        (" warning ", logging.WARNING),
+        ("10", 10),
+        ("verbose", None),
+        ("", None),
+    ],
+)
+def test_resolve_log_level(value, level):
+    """Test that log level settings are parsed without raising."""
+    assert server._resolve_log_level(value) == level
+
+
+@pytest.fixture
+def restore_root_logging():
+    """Put back the root logger's handlers and level after a test."""
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+@pytest.mark.parametrize(
+    "setting, level",
+    [
+        (None, logging.WARNING),
+        ("DEBUG", logging.DEBUG),
+        ("error", logging.ERROR),
+        ("verbose", logging.WARNING),
+    ],
+)
+def test_main_applies_log_level(monkeypatch, restore_root_logging, setting, level):
+    """Test that MCP_OPENVISION_LOG sets the level the server logs at."""
+    if setting is None:
+        monkeypatch.delenv("MCP_OPENVISION_LOG", raising=False)
+    else:
+        monkeypatch.setenv("MCP_OPENVISION_LOG", setting)
+
+    with patch.object(server.mcp, "run") as mock_run:
+        server.main()
+
+    mock_run.assert_called_once()
+    assert logging.getLogger().level == level
+    assert server.logger.getEffectiveLevel() == level